@@ -5,115 +5,330 @@
 """
 
 import argparse
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+import asyncio
+import logging
+import sys
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
-def annotate_image_search(query: str, headless: bool = True):
+log = logging.getLogger(__name__)
+
+# 默认的浏览器视口尺寸
+DEFAULT_VIEWPORT = {"width": 1280, "height": 720}
+# 标注任务不需要的请求（跟踪、统计、字体和音视频）的 URL 模式，由浏览器直接拦截
+# 模式末尾的 * 用于匹配带查询参数的 URL（例如 font.ttf?v=1）
+BLOCKED_URL_PATTERNS = [
+    # 跟踪和统计
+    "*bat.bing.com*", "*/analytics*",
+    # 字体
+    "*.woff*", "*.ttf*", "*.otf*", "*.eot*",
+    # 音视频
+    "*.mp4*", "*.webm*", "*.m3u8*",
+]
+
+
+async def block_low_value_requests(page):
     """
-    启动浏览器，搜索图片，用数字标注它们，并截取屏幕截图。
+    让浏览器直接拦截与标注无关的请求（跟踪、统计和字体），放行其余请求（包括文档和图片）。
 
-    :param query: 要搜索的图片关键词。
-    :param headless: 是否以无头模式运行浏览器。
+    这里通过 CDP 的 Network.setBlockedURLs 在浏览器内部拦截，而不使用 page.route：
+    启用路由后 Playwright 会禁用该页面的 HTTP 缓存，并且每个请求都要经过 Python 端往返一次。
+
+    :return: 创建的 CDPSession，调用方用完后应调用其 detach()。
     """
-    with sync_playwright() as p:
+    cdp = await page.context.new_cdp_session(page)
+    await cdp.send("Network.enable")
+    await cdp.send("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    return cdp
+
+
+# 这段 JavaScript 代码会找到页面上所有的图片，并在每张图片的左上角绘制一个数字标签。
+# 所有标签都绘制在同一个覆盖整个页面的 <canvas> 上，只新增一个 DOM 节点、只需一次绘制。
+# 这些标签被设计成高对比度和清晰可见，以便后续的 VLM 模型处理。
+ANNOTATE_JS = """
+() => {
+    // 选择所有代表搜索结果的图片元素 (img.mimg 是一个比较可靠的选择器)
+    const images = document.querySelectorAll('div.img_cont img.mimg');
+
+    // 第一遍：只读取布局信息（位置和尺寸），不修改 DOM，避免读写交替导致的反复重排
+    const scrollX = window.scrollX;
+    const scrollY = window.scrollY;
+    const pageWidth = document.documentElement.scrollWidth;
+    const pageHeight = document.documentElement.scrollHeight;
+    const rects = Array.from(images).map(img => img.getBoundingClientRect());
+    // 隐藏或尚未渲染的容器的边界框全为 0，会把并集拉回页面原点，因此排除它们
+    const containerRects = Array.from(document.querySelectorAll('div.img_cont'))
+        .map(cont => cont.getBoundingClientRect())
+        .filter(r => r.width > 0 && r.height > 0);
+
+    // 创建一个覆盖整个页面的画布，不拦截鼠标事件，z-index 确保标签在最上层
+    const dpr = window.devicePixelRatio || 1;
+    const canvas = document.createElement('canvas');
+    canvas.width = pageWidth * dpr;
+    canvas.height = pageHeight * dpr;
+    canvas.style.cssText = `position: absolute; top: 0; left: 0; width: ${pageWidth}px; ` +
+        `height: ${pageHeight}px; pointer-events: none; z-index: 9999`;
+    const ctx = canvas.getContext('2d');
+    ctx.scale(dpr, dpr);
+
+    // --- 标签样式 ---
+    // 设计目标：高可见性，以便 VLM 识别
+    // 鲜艳的红色背景、白色粗体文字、白色边框和阴影以增加对比度
+    ctx.font = 'bold 16px Arial, sans-serif';
+    ctx.textBaseline = 'top';
+    ctx.lineWidth = 2;
+    const paddingX = 6;
+    const paddingY = 3;
+    const textHeight = 16;
+
+    // 第二遍：只在画布上绘制，将标签定位到图片的左上角（考虑页面滚动）
+    rects.forEach((rect, index) => {
+        const text = `${index + 1}`;
+        const x = scrollX + rect.left;
+        const y = scrollY + rect.top;
+        const width = ctx.measureText(text).width + paddingX * 2;
+        const height = textHeight + paddingY * 2;
+
+        ctx.shadowColor = 'rgba(0, 0, 0, 0.5)';
+        ctx.shadowBlur = 5;
+        ctx.fillStyle = 'rgba(255, 20, 20, 0.85)';
+        ctx.fillRect(x, y, width, height);
+        ctx.shadowBlur = 0;
+        ctx.strokeStyle = 'white';
+        ctx.strokeRect(x, y, width, height);
+        ctx.fillStyle = 'white';
+        ctx.fillText(text, x + paddingX, y + paddingY);
+    });
+
+    // 只向文档中添加一个节点
+    document.body.appendChild(canvas);
+
+    // 计算所有图片容器的并集边界框（页面坐标），用于只截取搜索结果区域
+    let bbox = null;
+    if (containerRects.length > 0) {
+        const left = Math.min(...containerRects.map(r => r.left));
+        const top = Math.min(...containerRects.map(r => r.top));
+        const right = Math.max(...containerRects.map(r => r.right));
+        const bottom = Math.max(...containerRects.map(r => r.bottom));
+        // Playwright 不接受宽或高为 0 的裁剪区域，此时退回到截取整个页面
+        if (right > left && bottom > top) {
+            bbox = {
+                x: scrollX + left,
+                y: scrollY + top,
+                width: right - left,
+                height: bottom - top,
+            };
+        }
+    }
+
+    // 返回找到的图片数量和搜索结果区域的边界框
+    return { count: images.length, bbox: bbox };
+}
+"""
+
+
+class ImageSearchSession:
+    """
+    持有一个长期存活的 Playwright 浏览器会话，以便在多次查询之间复用。
+
+    Chromium 只在进入上下文时启动一次，从而避免每次查询都要付出浏览器冷启动的开销。
+
+    默认情况下，每次查询使用独立的临时浏览器上下文，
+    多个并发查询之间的 Cookie 和页面状态彼此隔离。
+
+    也可以指定一个持久化的配置目录 (user_data_dir，例如 ".pw_profile")，
+    这样 Chromium 无需每次都初始化全新的配置，并且后续运行可以命中必应静态资源的 HTTP 缓存。
+    此时所有查询共用同一个上下文（共享 Cookie），每个查询只打开一个新页面。
+    注意 Chromium 会锁定正在使用的配置目录：同一个目录同时只能被一个进程使用，
+    并行运行的多个进程（例如多个 --server 工作进程）必须各自使用不同的目录。
+
+    用法::
+
+        async with ImageSearchSession() as session:
+            await asyncio.gather(
+                session.search("cute cats", "cats.png"),
+                session.search("cute dogs", "dogs.png"),
+            )
+    """
+
+    def __init__(self, headless: bool = True, user_data_dir: str = None):
+        """
+        :param headless: 是否以无头模式运行浏览器。
+        :param user_data_dir: 可选的持久化浏览器配置目录，为 None 时每次查询使用独立的临时上下文。
+        """
+        self.headless = headless
+        self.user_data_dir = user_data_dir
+        self._playwright = None
+        self._browser = None
+        self._context = None
+
+    async def __aenter__(self):
+        self._playwright = await async_playwright().start()
         # 启动浏览器实例
         # 在调试时可以设置 headless=False 以便观察浏览器操作
-        browser = p.chromium.launch(headless=False)
-        page = browser.new_page()
+        try:
+            if self.user_data_dir:
+                self._context = await self._playwright.chromium.launch_persistent_context(
+                    self.user_data_dir, headless=self.headless, viewport=DEFAULT_VIEWPORT
+                )
+            else:
+                self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        except BaseException:
+            # 启动失败时 async with 不会调用 __aexit__，需要在这里停止已启动的 Playwright
+            await self._playwright.stop()
+            self._playwright = None
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # 关闭浏览器
+        if self._context is not None:
+            await self._context.close()
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+        self._context = self._browser = self._playwright = None
+        log.info("浏览器已关闭。")
 
+    async def search(self, query: str, screenshot_path: str = None):
+        """
+        搜索图片，用数字标注它们，并截取屏幕截图。
+
+        截图直接以字节形式返回，调用方无需再从磁盘读回。
+
+        :param query: 要搜索的图片关键词。
+        :param screenshot_path: 可选，同时将截图保存到该路径（例如用于调试）。
+        :return: 成功时返回 PNG 截图的字节，失败时返回 None。
+        """
+        png_bytes = None
+        if self._context is not None:
+            # 持久化配置下所有查询共用同一个上下文，只需打开一个新页面
+            context = None
+            page = await self._context.new_page()
+        else:
+            # 每个查询使用独立的上下文，以便并发执行时互不干扰
+            context = await self._browser.new_context(viewport=DEFAULT_VIEWPORT)
+            page = await context.new_page()
+
+        cdp = None
         try:
+            # 拦截无用的子资源，让页面更快达到网络空闲状态
+            cdp = await block_low_value_requests(page)
+
             # 1. 导航到必应图片搜索
-            print("正在导航到必应图片...")
-            page.goto("https://www.bing.com/images/search", timeout=60000)
+            log.info("正在导航到必应图片...")
+            await page.goto("https://www.bing.com/images/search", timeout=60000)
 
             # 2. 找到搜索框，输入关键词并提交
-            print(f"正在搜索关键词: '{query}'...")
+            log.info(f"正在搜索关键词: '{query}'...")
             # 使用 #sb_form_q 作为搜索框的选择器
             search_box_selector = "#sb_form_q"
-            page.wait_for_selector(search_box_selector, state="visible", timeout=10000)
-            page.fill(search_box_selector, query)
-            page.press(search_box_selector, "Enter")
+            await page.wait_for_selector(search_box_selector, state="visible", timeout=10000)
+            await page.fill(search_box_selector, query)
+            await page.press(search_box_selector, "Enter")
 
             # 3. 等待搜索结果加载
-            print("等待搜索结果加载...")
+            log.info("等待搜索结果加载...")
             # 等待第一个图片容器出现，这是一个好迹象，表明结果正在加载
             # 选择器 'div.img_cont' 匹配包含图片的容器
             image_container_selector = "div.img_cont"
-            page.wait_for_selector(image_container_selector, state="visible", timeout=15000)
-            # 等待一小段时间，让更多的图片加载进来
-            page.wait_for_timeout(3000)
+            await page.wait_for_selector(image_container_selector, state="visible", timeout=15000)
+            # 等待网络空闲，让更多的图片加载进来，而不是固定地等待一段时间
+            # 页面可能持续发出后台请求，因此超时后直接处理已加载的图片
+            try:
+                await page.wait_for_load_state("networkidle", timeout=10000)
+            except PlaywrightTimeoutError:
+                log.warning("等待网络空闲超时，继续处理已加载的图片...")
 
             # 4. 核心功能: 注入 JavaScript 来标注图片
-            print("正在执行 JavaScript 以标注图片...")
-            
-            # 这段 JavaScript 代码会找到页面上所有的图片，并在每张图片的左上角添加一个数字标签。
-            # 这些标签被设计成高对比度和清晰可见，以便后续的 VLM 模型处理。
-            js_code = """
-            () => {
-                // 选择所有代表搜索结果的图片元素 (img.mimg 是一个比较可靠的选择器)
-                const images = document.querySelectorAll('div.img_cont img.mimg');
-                
-                // 遍历每张图片并添加一个带样式的数字标签
-                images.forEach((img, index) => {
-                    // 创建标签元素
-                    const label = document.createElement('div');
-                    
-                    // 获取图片在视口中的位置和尺寸
-                    const rect = img.getBoundingClientRect();
-
-                    // 设置标签文本
-                    label.innerText = `${index + 1}`;
-                    
-                    // --- 标签样式 ---
-                    // 设计目标：高可见性，以便 VLM 识别
-                    label.style.position = 'absolute';
-                    // 将标签定位到图片的左上角（考虑页面滚动）
-                    label.style.top = `${window.scrollY + rect.top}px`;
-                    label.style.left = `${window.scrollX + rect.left}px`;
-                    label.style.backgroundColor = 'rgba(255, 20, 20, 0.85)'; // 鲜艳的红色背景
-                    label.style.color = 'white'; // 白色文字
-                    label.style.padding = '3px 6px'; // 内边距
-                    label.style.fontSize = '16px'; // 清晰的字体大小
-                    label.style.fontWeight = 'bold'; // 粗体
-                    label.style.border = '2px solid white'; // 白色边框增加对比度
-                    label.style.borderRadius = '4px'; // 圆角
-                    label.style.zIndex = '9999'; // 确保标签在最上层
-                    label.style.fontFamily = 'Arial, sans-serif'; // 通用字体
-                    label.style.boxShadow = '0 0 5px rgba(0,0,0,0.5)'; // 添加阴影以突出
-                    
-                    // 将标签添加到文档中
-                    document.body.appendChild(label);
-                });
-                
-                // 返回找到的图片数量
-                return images.length;
-            }
-            """
-            
-            # 执行 JavaScript 并获取标注的图片数量
-            annotated_count = page.evaluate(js_code)
-            print(f"成功标注了 {annotated_count} 张图片。")
-
-            # 5. 截取整个页面的截图
-            screenshot_path = "labeled_screenshot.png"
-            print(f"正在截取全屏并保存到 '{screenshot_path}'...")
-            page.screenshot(path=screenshot_path, full_page=True)
-            print("截图成功保存。")
-            
-            page.wait_for_timeout(3000)
+            log.info("正在执行 JavaScript 以标注图片...")
+
+            # 执行 JavaScript 并获取标注的图片数量和搜索结果区域
+            result = await page.evaluate(ANNOTATE_JS)
+            log.info(f"成功标注了 {result['count']} 张图片。")
+
+            # 5. 截取搜索结果区域的截图（页眉、侧栏和页脚对 VLM 没有用处）
+            # 找不到结果区域时退回到截取整个页面
+            bbox = result["bbox"]
+            area = "搜索结果区域" if bbox else "全屏"
+            if screenshot_path:
+                log.info(f"正在截取{area}并保存到 '{screenshot_path}'...")
+            else:
+                log.info(f"正在截取{area}...")
+            png_bytes = await page.screenshot(path=screenshot_path, full_page=True, clip=bbox)
+            log.info("截图成功。")
 
         except PlaywrightTimeoutError as e:
-            print(f"操作超时: {e}")
-            print("请检查您的网络连接，或尝试增加超时时间。")
-            page.screenshot(path="error_screenshot.png")
-            print("已保存当前页面的截图 'error_screenshot.png' 以供调试。")
+            png_bytes = None
+            log.error(f"操作超时: {e}")
+            log.error("请检查您的网络连接，或尝试增加超时时间。")
+            await page.screenshot(path="error_screenshot.png")
+            log.info("已保存当前页面的截图 'error_screenshot.png' 以供调试。")
         except Exception as e:
-            print(f"发生未知错误: {e}")
-            page.screenshot(path="error_screenshot.png")
-            print("已保存当前页面的截图 'error_screenshot.png' 以供调试。")
+            png_bytes = None
+            log.error(f"发生未知错误: {e}")
+            await page.screenshot(path="error_screenshot.png")
+            log.info("已保存当前页面的截图 'error_screenshot.png' 以供调试。")
         finally:
-            # 6. 关闭浏览器
-            browser.close()
-            print("浏览器已关闭。")
+            # 6. 关闭页面（或临时上下文），浏览器留给后续查询复用
+            if cdp is not None:
+                await cdp.detach()
+            if context is not None:
+                await context.close()
+            else:
+                await page.close()
+
+        return png_bytes
+
+
+async def annotate_image_search(query: str, headless: bool = True,
+                                screenshot_path: str = "labeled_screenshot.png",
+                                user_data_dir: str = None):
+    """
+    启动浏览器，搜索图片，用数字标注它们，并截取屏幕截图。
+
+    需要执行多次查询时，请直接使用 ImageSearchSession 以复用浏览器。
+
+    :param query: 要搜索的图片关键词。
+    :param headless: 是否以无头模式运行浏览器。
+    :param screenshot_path: 截图的保存路径，为 None 时不写入磁盘。
+    :param user_data_dir: 可选的持久化浏览器配置目录。
+    :return: 成功时返回 PNG 截图的字节，失败时返回 None。
+    """
+    async with ImageSearchSession(headless=headless, user_data_dir=user_data_dir) as session:
+        return await session.search(query, screenshot_path)
+
+
+async def serve(headless: bool = True, user_data_dir: str = None):
+    """
+    服务模式：浏览器只启动一次，然后从标准输入逐行读取查询。
+
+    每处理完一个查询，就向标准输出打印一行截图文件路径（失败时打印空行），
+    这样调用方可以用一个长期运行的子进程处理所有查询，只付出一次启动开销。
+    进度信息通过 logging 输出到标准错误，以免干扰标准输出上的结果。
+
+    :param headless: 是否以无头模式运行浏览器。
+    :param user_data_dir: 可选的持久化浏览器配置目录，同一时间只能被一个工作进程使用。
+    """
+    # 无论系统区域设置如何（例如 Windows 上的 GBK），都以 UTF-8 与调用方通信
+    sys.stdin.reconfigure(encoding="utf-8")
+    sys.stdout.reconfigure(encoding="utf-8")
+
+    async with ImageSearchSession(headless=headless, user_data_dir=user_data_dir) as session:
+        index = 0
+        while True:
+            line = await asyncio.to_thread(sys.stdin.readline)
+            if not line:
+                break # 标准输入已关闭
+
+            query = line.strip()
+            png_bytes = None
+            if query:
+                index += 1
+                screenshot_path = f"labeled_screenshot_{index}.png"
+                png_bytes = await session.search(query, screenshot_path)
+
+            print(screenshot_path if png_bytes is not None else "", flush=True)
 
 if __name__ == "__main__":
     # 设置命令行参数解析器
@@ -124,6 +339,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "query", 
         type=str, 
+        nargs="?",
         help="要搜索的图片关键词。\n例如: 'cute cats'"
     )
     parser.add_argument(
@@ -132,8 +348,29 @@ if __name__ == "__main__":
         dest="headless",
         help="运行浏览器时显示 GUI 界面，用于调试。"
     )
+    parser.add_argument(
+        "--profile-dir",
+        dest="user_data_dir",
+        help="持久化浏览器配置目录（例如 .pw_profile），用于跨运行复用缓存。\n"
+             "同一目录同时只能被一个进程使用。"
+    )
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help="服务模式：从标准输入逐行读取查询，并在标准输出逐行返回截图路径。"
+    )
     
     args = parser.parse_args()
+
+    # 进度信息输出到标准错误，标准输出只用于返回结果
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(message)s")
     
     # 运行主函数
-    annotate_image_search(args.query, headless=args.headless)
\ No newline at end of file
+    if args.server:
+        asyncio.run(serve(headless=args.headless, user_data_dir=args.user_data_dir))
+    elif args.query is None:
+        parser.error("需要提供要搜索的图片关键词，或使用 --server。")
+    else:
+        asyncio.run(annotate_image_search(
+            args.query, headless=args.headless, user_data_dir=args.user_data_dir
+        ))
\ No newline at end of file
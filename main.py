@@ -1,105 +1,147 @@
 import argparse
-import subprocess
+import asyncio
+import logging
 import sys
 from dotenv import load_dotenv
 
 # 从 .env 文件加载环境变量
+# 必须在导入 vlm_selector 之前加载，这样整个进程只解析一次 .env
 load_dotenv()
 
-def run_image_search(query):
+from image_search_annotator import ImageSearchSession
+from vlm_selector import call_vlm_api
+
+log = logging.getLogger(__name__)
+
+async def run_image_search(session, query):
     """
-    运行图像搜索脚本 (image_search_annotator.py).
+    运行图像搜索和标注 (image_search_annotator.ImageSearchSession).
 
     Args:
+        session (ImageSearchSession): 已启动的浏览器会话，可在多次查询间复用.
         query (str): 图像搜索的关键词.
 
     Returns:
-        bool: 如果脚本成功执行则返回 True, 否则返回 False.
+        bytes: 带标注截图的 PNG 字节，如果失败则返回 None.
     """
-    print(f"正在使用查询 '{query}' 搜索图像...")
+    log.info(f"正在使用查询 '{query}' 搜索图像...")
     try:
-        # 调用 image_search_annotator.py 脚本
-        # 我们只关心它是否成功执行并创建了 labeled_screenshot.png
-        subprocess.run(
-            [sys.executable, "image_search_annotator.py", query],
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        print("图像搜索和标注完成。")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"错误: 运行 image_search_annotator.py 失败。", file=sys.stderr)
-        print(f"返回码: {e.returncode}", file=sys.stderr)
-        print(f"输出: {e.stdout}", file=sys.stderr)
-        print(f"错误输出: {e.stderr}", file=sys.stderr)
-        return False
-    except FileNotFoundError:
-        print("错误: 'image_search_annotator.py' 未找到。请确保它在当前目录中。", file=sys.stderr)
-        return False
-
-
-def run_vlm_selector(prompt):
+        screenshot = await session.search(query)
+    except Exception as e:
+        log.error(f"错误: 查询 '{query}' 的图像搜索和标注失败: {e}")
+        return None
+
+    if screenshot is None:
+        log.error(f"错误: 查询 '{query}' 的图像搜索和标注未能生成截图。")
+        return None
+
+    log.info(f"查询 '{query}' 的图像搜索和标注完成。")
+    return screenshot
+
+
+async def run_vlm_selector(image, prompt):
     """
-    运行 VLM 选择器脚本 (vlm_selector.py).
+    运行 VLM 选择器 (vlm_selector.call_vlm_api).
 
     Args:
+        image (bytes): 带标注截图的 PNG 字节.
         prompt (str): 用于 VLM 分析的文本提示.
 
     Returns:
         str: VLM 选择的最佳图片的数字标签，如果失败则返回 None.
     """
-    print(f"正在使用提示 '{prompt}' 运行 VLM 选择器...")
-    image_path = "labeled_screenshot.png"
+    log.info(f"正在使用提示 '{prompt}' 运行 VLM 选择器...")
     try:
-        # 调用 vlm_selector.py 脚本并捕获其标准输出
-        result = subprocess.run(
-            [sys.executable, "vlm_selector.py", image_path, prompt],
-            check=True,
-            capture_output=True,
-            text=True,
-            encoding='gbk' # 在Windows上使用GBK编码以避免解码错误
-        )
-        # 移除输出中可能存在的多余空白字符
-        selected_label = result.stdout.strip()
-        print(f"VLM 选择器完成，输出为: '{selected_label}'")
-        return selected_label
-    except subprocess.CalledProcessError as e:
-        print(f"错误: 运行 vlm_selector.py 失败。", file=sys.stderr)
-        print(f"返回码: {e.returncode}", file=sys.stderr)
-        print(f"输出: {e.stdout}", file=sys.stderr)
-        print(f"错误输出: {e.stderr}", file=sys.stderr)
+        # 标签直接以 Python 字符串返回，无需解析子进程输出
+        selected_label = await call_vlm_api(image, prompt)
+    except Exception as e:
+        log.error(f"错误: 运行 VLM 选择器失败: {e}")
         return None
-    except FileNotFoundError:
-        print("错误: 'vlm_selector.py' 或 'labeled_screenshot.png' 未找到。", file=sys.stderr)
+
+    # call_vlm_api 出错时返回错误信息而不是抛出异常，只有纯数字才是有效的标签
+    if not selected_label.isdigit():
+        log.error(f"错误: 运行 VLM 选择器失败: {selected_label}")
         return None
 
+    log.info(f"VLM 选择器完成，输出为: '{selected_label}'")
+    return selected_label
+
+
+async def process_query(session, query, prompt):
+    """
+    对单个查询依次运行图像搜索和 VLM 选择器.
+
+    Args:
+        session (ImageSearchSession): 已启动的浏览器会话.
+        query (str): 图像搜索的关键词.
+        prompt (str): 用于 VLM 分析的文本提示.
+
+    Returns:
+        str: VLM 选择的最佳图片的数字标签，如果任一步骤失败则返回 None.
+    """
+    screenshot = await run_image_search(session, query)
+    if screenshot is None:
+        return None # 图像搜索失败，跳过该查询
+    return await run_vlm_selector(screenshot, prompt)
+
+
+async def process_queries(queries, prompt, headless=True, user_data_dir=None):
+    """
+    在同一个浏览器会话中并发处理多个查询.
+
+    Args:
+        queries (list[str]): 图像搜索的关键词列表.
+        prompt (str): 用于 VLM 分析的文本提示.
+        headless (bool): 是否以无头模式运行浏览器.
+        user_data_dir (str): 可选的持久化浏览器配置目录，为 None 时每个查询使用独立的上下文.
+
+    Returns:
+        list: 与 queries 一一对应的数字标签，失败的查询对应 None.
+    """
+    # 浏览器只启动一次，所有查询并发执行；某个查询的截图完成后立即请求 VLM，
+    # 不必等待其他查询的搜索结束，总耗时取决于最慢的那个查询
+    async with ImageSearchSession(headless=headless, user_data_dir=user_data_dir) as session:
+        return await asyncio.gather(*[process_query(session, query, prompt) for query in queries])
+
 def main():
     """
     主函数，用于协调图像搜索和 VLM 选择过程。
     """
+    # 进度信息输出到标准错误，标准输出只保留最终结果
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(message)s")
+
     # 1. 设置命令行参数解析器
     parser = argparse.ArgumentParser(description="使用VLM从图像搜索结果中选择最佳图片。")
-    parser.add_argument("-q", "--query", type=str, required=True, help="用于图像搜索的关键词。")
+    parser.add_argument("-q", "--query", type=str, nargs="+", required=True, help="用于图像搜索的关键词，可指定多个以并发搜索。")
     parser.add_argument("-p", "--prompt", type=str, required=True, help="用于VLM分析的文本提示。")
+    parser.add_argument("--visible", action="store_false", dest="headless", help="运行浏览器时显示 GUI 界面，用于调试。")
+    parser.add_argument("--profile-dir", dest="user_data_dir", help="持久化浏览器配置目录（例如 .pw_profile），同一目录同时只能被一个进程使用。")
 
     args = parser.parse_args()
 
     # 2. 工作流程
-    # 步骤 1: 运行图像搜索和标注脚本
-    if not run_image_search(args.query):
-        sys.exit(1) # 如果图像搜索失败，则退出
-
-    # 步骤 2: 运行 VLM 选择器脚本
-    selected_image_label = run_vlm_selector(args.prompt)
-
-    # 步骤 3 & 4: 捕获并打印最终结果
-    if selected_image_label:
-        print("\n=====================================")
-        print(f"VLM选择的图片是: {selected_image_label}")
-        print("=====================================")
-    else:
-        print("\n无法从VLM选择器获取结果。", file=sys.stderr)
+    # 步骤 1 & 2: 并发运行图像搜索和标注，以及 VLM 选择器
+    try:
+        selected_image_labels = asyncio.run(process_queries(
+            args.query, args.prompt, headless=args.headless, user_data_dir=args.user_data_dir
+        ))
+    except Exception as e:
+        # 例如未安装 Chromium，或 --profile-dir 指定的配置目录正被其他进程使用
+        log.error(f"错误: 启动浏览器失败: {e}")
+        sys.exit(1)
+
+    failed = False
+    for query, selected_image_label in zip(args.query, selected_image_labels):
+        # 步骤 3 & 4: 捕获并打印最终结果
+        if selected_image_label:
+            print("\n=====================================")
+            print(f"查询 '{query}' 中 VLM选择的图片是: {selected_image_label}")
+            print("=====================================")
+        else:
+            log.error(f"无法从VLM选择器获取查询 '{query}' 的结果。")
+            failed = True
+
+    if failed:
         sys.exit(1)
 
 if __name__ == "__main__":
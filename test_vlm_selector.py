@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+vlm_selector.py 中 VLM 结果缓存的单元测试。
+
+运行:
+python -m unittest test_vlm_selector
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import vlm_selector
+
+
+class CacheTestCase(unittest.TestCase):
+    """每个测试使用独立的临时缓存文件和空的内存缓存。"""
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+        self.cache_path = os.path.join(self._tmp_dir.name, ".vlm_cache.json")
+
+        patcher = mock.patch.multiple(vlm_selector, CACHE_PATH=self.cache_path, _cache=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_cache_file(self, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        with open(self.cache_path, "wb") as cache_file:
+            cache_file.write(content)
+
+    def read_cache_file(self):
+        with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+            return json.load(cache_file)
+
+
+class MakeCacheKeyTest(unittest.TestCase):
+
+    def test_same_inputs_give_same_key(self):
+        self.assertEqual(
+            vlm_selector.make_cache_key(b"image", "prompt", "model"),
+            vlm_selector.make_cache_key(b"image", "prompt", "model"),
+        )
+
+    def test_each_input_changes_key(self):
+        key = vlm_selector.make_cache_key(b"image", "prompt", "model")
+        self.assertNotEqual(key, vlm_selector.make_cache_key(b"other", "prompt", "model"))
+        self.assertNotEqual(key, vlm_selector.make_cache_key(b"image", "other", "model"))
+        self.assertNotEqual(key, vlm_selector.make_cache_key(b"image", "prompt", "other"))
+
+    def test_parts_are_separated(self):
+        # 不同的切分方式不应得到相同的键
+        self.assertNotEqual(
+            vlm_selector.make_cache_key(b"ab", "c", "model"),
+            vlm_selector.make_cache_key(b"a", "bc", "model"),
+        )
+
+    def test_version_changes_key(self):
+        key = vlm_selector.make_cache_key(b"image", "prompt", "model")
+        with mock.patch.object(vlm_selector, "CACHE_VERSION", vlm_selector.CACHE_VERSION + "-next"):
+            self.assertNotEqual(key, vlm_selector.make_cache_key(b"image", "prompt", "model"))
+
+
+class LruCacheTest(CacheTestCase):
+
+    def test_miss_returns_none(self):
+        self.assertIsNone(vlm_selector.get_cached_label("missing"))
+
+    def test_put_then_get(self):
+        vlm_selector.put_cached_label("a", "1")
+        self.assertEqual(vlm_selector.get_cached_label("a"), "1")
+
+    def test_evicts_least_recently_used(self):
+        with mock.patch.object(vlm_selector, "CACHE_MAX_ENTRIES", 2):
+            vlm_selector.put_cached_label("a", "1")
+            vlm_selector.put_cached_label("b", "2")
+            # 访问 a 后，b 成为最久未使用的条目
+            vlm_selector.get_cached_label("a")
+            vlm_selector.put_cached_label("c", "3")
+
+        self.assertEqual(vlm_selector.get_cached_label("a"), "1")
+        self.assertIsNone(vlm_selector.get_cached_label("b"))
+        self.assertEqual(vlm_selector.get_cached_label("c"), "3")
+
+    def test_load_trims_oversized_file(self):
+        self.write_cache_file(json.dumps({"a": "1", "b": "2", "c": "3"}))
+        with mock.patch.object(vlm_selector, "CACHE_MAX_ENTRIES", 2):
+            self.assertEqual(vlm_selector.load_cache(), {"b": "2", "c": "3"})
+
+
+class SaveCacheTest(CacheTestCase):
+
+    def test_round_trip(self):
+        vlm_selector.put_cached_label("a", "1")
+        vlm_selector.save_cache()
+
+        vlm_selector._cache = None
+        self.assertEqual(vlm_selector.get_cached_label("a"), "1")
+
+    def test_merges_entries_written_by_other_process(self):
+        vlm_selector.put_cached_label("a", "1")
+        vlm_selector.save_cache()
+
+        # 模拟另一个进程在此期间写入了新的条目
+        self.write_cache_file(json.dumps({"a": "1", "other": "9"}))
+
+        vlm_selector.put_cached_label("b", "2")
+        vlm_selector.save_cache()
+
+        self.assertEqual(self.read_cache_file(), {"a": "1", "other": "9", "b": "2"})
+
+    def test_merge_respects_max_entries(self):
+        self.write_cache_file(json.dumps({"old1": "1", "old2": "2"}))
+        vlm_selector._cache = {}
+
+        with mock.patch.object(vlm_selector, "CACHE_MAX_ENTRIES", 2):
+            vlm_selector.put_cached_label("new", "3")
+            vlm_selector.save_cache()
+
+        # 本进程的条目视为最近使用，淘汰磁盘上最旧的条目
+        self.assertEqual(self.read_cache_file(), {"old2": "2", "new": "3"})
+
+    def test_leaves_no_temp_files(self):
+        vlm_selector.put_cached_label("a", "1")
+        vlm_selector.save_cache()
+        self.assertEqual(os.listdir(self._tmp_dir.name), [".vlm_cache.json"])
+
+    def test_write_failure_raises_os_error(self):
+        vlm_selector.put_cached_label("a", "1")
+        missing_dir = os.path.join(self._tmp_dir.name, "missing", ".vlm_cache.json")
+        with mock.patch.object(vlm_selector, "CACHE_PATH", missing_dir):
+            with self.assertRaises(OSError):
+                vlm_selector.save_cache()
+
+
+class BadCacheFileTest(CacheTestCase):
+
+    def test_non_utf8_file_is_treated_as_empty(self):
+        self.write_cache_file(b"\xff\xfe\x00garbage")
+        self.assertEqual(vlm_selector.load_cache(), {})
+
+        vlm_selector.put_cached_label("a", "1")
+        vlm_selector.save_cache()
+        self.assertEqual(self.read_cache_file(), {"a": "1"})
+
+    def test_invalid_json_is_treated_as_empty(self):
+        self.write_cache_file("{not json")
+        self.assertEqual(vlm_selector.load_cache(), {})
+
+    def test_unreadable_path_is_treated_as_empty(self):
+        os.mkdir(self.cache_path)
+        self.assertEqual(vlm_selector.load_cache(), {})
+
+    def test_non_object_json_is_treated_as_empty(self):
+        self.write_cache_file(json.dumps(["1", "2"]))
+        self.assertEqual(vlm_selector.load_cache(), {})
+
+    def test_non_digit_values_are_dropped(self):
+        self.write_cache_file(json.dumps({"int": 5, "text": "abc", "none": None, "ok": "7"}))
+        self.assertEqual(vlm_selector.load_cache(), {"ok": "7"})
+        self.assertIsNone(vlm_selector.get_cached_label("int"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,40 +19,205 @@ vlm_selector.py
 
 用法:
 python vlm_selector.py <图片路径> "<文本描述>"
+python vlm_selector.py --server
+
+服务模式下，脚本从标准输入逐行读取 "<图片路径>\\t<文本描述>"，
+并为每一行在标准输出打印一行结果。标准输入和输出始终使用 UTF-8 编码。
 
 示例:
 python vlm_selector.py labeled_screenshot.png "一只正在打哈欠的猫"
 """
 
+import io
 import os
+import re
+import asyncio
 import sys
+import json
+import logging
 import base64
-from openai import OpenAI
-from PIL import Image
+import hashlib
+import tempfile
+import functools
+import contextlib
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
+log = logging.getLogger(__name__)
+
 # 从 .env 文件加载环境变量
-load_dotenv()
+# 作为模块被 main.py 导入时，环境变量已经由 main.py 加载过，无需再次解析 .env；
+# 只要有任一变量未设置就加载 .env（load_dotenv 不会覆盖已设置的变量）
+if not all(os.getenv(k) for k in ("OPENAI_API_KEY", "OPENAI_API_BASE", "OPENAI_MODEL_NAME")):
+    load_dotenv()
+
+# 发送给VLM前图片的最大尺寸（宽, 高）。模型只需识别数字标签，无需原始分辨率
+MAX_IMAGE_SIZE = (1280, 8192)
+# JPEG 压缩质量
+JPEG_QUALITY = 78
+# VLM 结果的本地缓存文件，相同的截图和提示不必重复调用API
+CACHE_PATH = ".vlm_cache.json"
+# 缓存最多保留的条目数，超出时淘汰最久未使用的条目
+CACHE_MAX_ENTRIES = 256
+# 缓存格式版本，请求参数的变化可能导致旧结果无效时递增，使旧条目不再命中
+CACHE_VERSION = "2"
+
+# 内存中的缓存，首次使用时从 CACHE_PATH 加载。字典按使用顺序排列，最近使用的在末尾
+_cache = None
 
-def encode_image_to_base64(image_path):
-    """将图片文件编码为Base64字符串。"""
+def _read_cache_file():
+    """
+    读取磁盘上的缓存文件。
+
+    缓存只是锦上添花：文件不存在、无法读取或已损坏时一律视为空缓存，
+    并丢弃值不是数字字符串的条目（例如手动编辑或其他程序写入的内容）。
+    """
     try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        with open(CACHE_PATH, "r", encoding="utf-8") as cache_file:
+            data = json.load(cache_file)
+    except (OSError, ValueError): # ValueError 包括 JSONDecodeError 和 UnicodeDecodeError
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {
+        key: label for key, label in data.items()
+        if isinstance(label, str) and label.isdigit()
+    }
+
+
+def _trim_cache(cache):
+    """淘汰最久未使用的条目，使缓存不超过 CACHE_MAX_ENTRIES 条。"""
+    while len(cache) > CACHE_MAX_ENTRIES:
+        del cache[next(iter(cache))]
+
+
+def load_cache():
+    """加载（并缓存）本地的 VLM 结果缓存。"""
+    global _cache
+    if _cache is None:
+        _cache = _read_cache_file()
+        _trim_cache(_cache)
+    return _cache
+
+
+def get_cached_label(cache_key):
+    """查询缓存，命中时将该条目标记为最近使用。未命中时返回 None。"""
+    cache = load_cache()
+    label = cache.pop(cache_key, None)
+    if label is not None:
+        cache[cache_key] = label
+    return label
+
+
+def put_cached_label(cache_key, label):
+    """将结果写入内存中的缓存，必要时淘汰最久未使用的条目。"""
+    cache = load_cache()
+    cache.pop(cache_key, None)
+    cache[cache_key] = label
+    _trim_cache(cache)
+
+
+def save_cache():
+    """
+    将缓存写回 CACHE_PATH。
+
+    写入前先合并磁盘上由其他进程（例如并行的 --server 工作进程）写入的条目，避免互相覆盖；
+    数据先写入本进程独有的临时文件再原子替换，避免并发写入同一个临时文件或留下写到一半的文件。
+
+    Raises:
+        OSError: 写入缓存文件失败。
+    """
+    global _cache
+    cache = load_cache()
+    merged = _read_cache_file()
+    for key in cache:
+        merged.pop(key, None)
+    merged.update(cache) # 本进程的条目视为最近使用
+    _trim_cache(merged)
+    _cache = merged
+
+    cache_dir = os.path.dirname(os.path.abspath(CACHE_PATH))
+    tmp_file = tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=cache_dir, prefix=".vlm_cache.", suffix=".tmp", delete=False
+    )
+    try:
+        with tmp_file:
+            json.dump(merged, tmp_file, ensure_ascii=False)
+        os.replace(tmp_file.name, CACHE_PATH)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_file.name)
+        raise
+
+
+def make_cache_key(image_bytes, prompt, model_name):
+    """根据图片内容、完整提示和模型名称计算缓存键。"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in (CACHE_VERSION.encode("utf-8"), image_bytes, prompt.encode("utf-8"), model_name.encode("utf-8")):
+        h.update(part)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def compress_image(image):
+    """
+    将图片缩放到 MAX_IMAGE_SIZE 以内并重新编码为JPEG，以减少上传的数据量。
+
+    Args:
+        image (str | bytes): 图片文件路径，或图片的原始字节。
+
+    Returns:
+        memoryview: JPEG 图片数据（直接引用内部缓冲区，避免额外复制）。
+    """
+    # 延迟导入 PIL：缓存命中或出错时不会调用本函数，也就无需付出导入开销
+    from PIL import Image
+
+    # 已在内存中的图片字节直接解码，无需经过磁盘；文件路径则交给 PIL 直接读取
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+
+    with Image.open(image) as img:
+        img = img.convert("RGB") # JPEG 不支持透明通道
+        img.thumbnail(MAX_IMAGE_SIZE)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buffer.getbuffer()
+
+
+def encode_image_to_base64(image):
+    """将图片文件（路径）或图片字节压缩为JPEG后编码为Base64字符串。"""
+    try:
+        return base64.b64encode(compress_image(image)).decode('ascii')
     except FileNotFoundError:
-        print(f"错误：图片文件未找到于 '{image_path}'。", file=sys.stderr)
-        sys.exit(1)
+        log.error(f"错误：图片文件未找到于 '{image}'。")
+        raise
     except Exception as e:
-        print(f"错误：编码图片时出错: {e}", file=sys.stderr)
-        sys.exit(1)
+        log.error(f"错误：编码图片时出错: {e}")
+        raise
+
 
+@functools.lru_cache(maxsize=None)
+def get_client(api_key, base_url):
+    """
+    获取（并缓存）异步 OpenAI 客户端。
 
-def call_vlm_api(image_path, text_prompt):
+    客户端内部持有 HTTP 连接池，复用它可以在多次调用（包括并发调用）之间复用连接，
+    避免每次调用都重新建立连接和进行 TLS 握手。
+    客户端绑定到创建它的事件循环，因此同一进程中应只在一个事件循环里使用它。
+    """
+    return AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+
+async def call_vlm_api(image, text_prompt):
     """
     调用兼容OpenAI的VLM API来分析图片。
 
+    这是一个协程，多个调用可以通过 asyncio.gather 并发执行，
+    总耗时约为最慢的一次请求，而不是所有请求耗时之和。
+    成功的结果会按 (图片内容, 提示, 模型) 缓存到 CACHE_PATH，相同的请求直接返回缓存结果。
+
     Args:
-        image_path (str): 要分析的图片文件路径。
+        image (str | bytes): 要分析的图片文件路径，或图片的原始字节。
         text_prompt (str): 用于描述要寻找的图片的文本。
 
     Returns:
@@ -67,12 +232,6 @@ def call_vlm_api(image_path, text_prompt):
         return "错误：请确保 OPENAI_API_KEY, OPENAI_API_BASE, 和 OPENAI_MODEL_NAME 环境变量都已设置。"
 
     try:
-        client = OpenAI(api_key=api_key, base_url=base_url)
-
-        # 将图片编码为Base64
-        base64_image = encode_image_to_base64(image_path)
-        image_url = f"data:image/png;base64,{base64_image}"
-
         # 构造精确的提示
         prompt_template = f"""
         这是一张带有数字标签的图片搜索结果截图。请仔细观察图片中的每个带标签的区域。
@@ -80,8 +239,23 @@ def call_vlm_api(image_path, text_prompt):
         你的回答必须**仅仅**是那张最匹配图片的数字标签，不要包含任何其他文字、解释或标点符号。
         """
 
+        # 先查缓存，命中时无需上传图片
+        if not isinstance(image, (bytes, bytearray, memoryview)):
+            with open(image, "rb") as image_file:
+                image = image_file.read()
+        cache_key = make_cache_key(image, prompt_template, model_name)
+        cached_label = get_cached_label(cache_key)
+        if cached_label is not None:
+            return cached_label
+
+        client = get_client(api_key, base_url)
+
+        # 将图片编码为Base64（压缩图片是CPU密集型操作，放到线程中执行，以免阻塞其他并发请求）
+        base64_image = await asyncio.to_thread(encode_image_to_base64, image)
+        image_url = f"data:image/jpeg;base64,{base64_image}"
+
         # 调用API
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=model_name,
             messages=[
                 {
@@ -97,29 +271,79 @@ def call_vlm_api(image_path, text_prompt):
                     ],
                 }
             ],
-            max_tokens=10, # 限制token数量，因为我们只需要一个数字
+            # 限制token数量，因为我们只需要一个数字。有些分词器（例如 llava 使用的 Llama 分词器）
+            # 会单独输出一个前导空格 token，且每位数字各占一个 token，因此三位数的标签最多需要 4 个 token
+            max_tokens=5,
+            temperature=0, # 贪心解码，相同的输入总是得到相同的输出
+            stop=["\n"], # 数字之后的任何内容都不需要
         )
 
-        # 解析响应并提取数字
-        return response.choices[0].message.content.strip()
+        # 解析响应并提取数字，即使模型多输出了其他文字也能取到标签
+        content = response.choices[0].message.content or ""
+        match = re.search(r"\d+", content)
+        if match is None:
+            return f"错误：模型没有返回数字标签: '{content.strip()}'"
+        selected_label = match.group()
+
+        # 只缓存成功的结果；缓存写入失败不应影响已经得到的结果
+        put_cached_label(cache_key, selected_label)
+        try:
+            save_cache()
+        except OSError as e:
+            log.warning(f"警告：写入 VLM 结果缓存失败: {e}")
+        return selected_label
 
     except Exception as e:
         return f"调用API时发生未知错误: {e}"
 
+async def serve():
+    """
+    服务模式：从标准输入逐行读取 "<图片路径>\\t<文本描述>"，每行在标准输出返回一行结果。
+
+    调用方可以用一个长期运行的子进程处理所有请求，只付出一次解释器启动和导入的开销，
+    同时复用同一个 OpenAI 客户端的连接。
+    """
+    while True:
+        line = await asyncio.to_thread(sys.stdin.readline)
+        if not line:
+            break # 标准输入已关闭
+
+        image_file_path, sep, user_text_prompt = line.rstrip("\n").partition("\t")
+        if not sep:
+            selected_label = "错误：输入格式应为 \"<图片路径>\\t<文本描述>\"。"
+        else:
+            selected_label = await call_vlm_api(image_file_path, user_text_prompt)
+
+        # 每个请求的结果只占一行
+        print(" ".join(selected_label.splitlines()), flush=True)
+
+
 def main():
     """
     主函数，处理命令行参数并驱动脚本流程。
     """
+    # 无论系统区域设置如何（例如 Windows 上的 GBK），都以 UTF-8 输出结果，
+    # 调用方统一按 UTF-8 解码即可
+    sys.stdin.reconfigure(encoding="utf-8")
+    sys.stdout.reconfigure(encoding="utf-8")
+    # 日志输出到标准错误，标准输出只用于返回标签
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(message)s")
+
+    if sys.argv[1:] == ["--server"]:
+        asyncio.run(serve())
+        return
+
     # 检查命令行参数
     if len(sys.argv) != 3:
         print("用法: python vlm_selector.py <图片路径> \"<文本描述>\"", file=sys.stderr)
+        print("      python vlm_selector.py --server", file=sys.stderr)
         sys.exit(1)
 
     image_file_path = sys.argv[1]
     user_text_prompt = sys.argv[2]
 
     # 调用API并获取结果
-    selected_label = call_vlm_api(image_file_path, user_text_prompt)
+    selected_label = asyncio.run(call_vlm_api(image_file_path, user_text_prompt))
 
     # 打印结果到标准输出
     print(selected_label)